@@ -4,10 +4,38 @@ Data loading module for Task B RFQ Similarity Analysis.
 
 import pandas as pd
 from pathlib import Path
+import json
 import logging
+import os
 
 logger = logging.getLogger(__name__)
 
+# Parquet caching of the inputs is skipped when pyarrow is not installed
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+CACHE_SPEC_KEY = b'read_spec'  # Parquet schema metadata key holding the column/dtype selection of a cached copy
+
+# Columns consumed by the pipeline (grade_suffix and descriptive reference columns are unused)
+RFQ_TEXT_COLUMNS = ['id', 'grade', 'coating', 'finish', 'surface_type', 'surface_protection', 'form']
+RFQ_NUMERIC_COLUMNS = [
+    'thickness_min', 'thickness_max', 'width_min', 'width_max', 'length_min',
+    'height_min', 'height_max', 'weight_min', 'weight_max',
+    'inner_diameter_min', 'inner_diameter_max', 'outer_diameter_min', 'outer_diameter_max',
+    'yield_strength_min', 'yield_strength_max', 'tensile_strength_min', 'tensile_strength_max'
+]
+REFERENCE_COLUMNS = [
+    'Grade/Material',
+    'Carbon (C)', 'Manganese (Mn)', 'Silicon (Si)', 'Sulfur (S)',
+    'Phosphorus (P)', 'Chromium (Cr)', 'Nickel (Ni)', 'Molybdenum (Mo)',
+    'Vanadium (V)', 'Copper (Cu)', 'Aluminum (Al)', 'Titanium (Ti)',
+    'Niobium (Nb)', 'Boron (B)', 'Nitrogen (N)',
+    'Tensile strength (Rm)', 'Yield strength (Re or Rp0.2)', 'Elongation (A%)'
+]
+
 def load_rfq_data():
 
     print("\n=== Data Loading ===")
@@ -16,9 +44,13 @@ def load_rfq_data():
     rfq_path = task2_dir / "rfq.csv"
     reference_path = task2_dir / "reference_properties.tsv"
     
-    # Load the datasets
-    rfq_df = pd.read_csv(rfq_path)
-    reference_df = pd.read_csv(reference_path, sep='\t')
+    # Load the datasets (parquet copies are reused while newer than the source files)
+    rfq_dtypes = {col: str for col in RFQ_TEXT_COLUMNS}
+    rfq_dtypes.update({col: 'float32' for col in RFQ_NUMERIC_COLUMNS})
+    reference_dtypes = {col: str for col in REFERENCE_COLUMNS}
+    
+    rfq_df = read_with_parquet_cache(rfq_path, usecols=list(rfq_dtypes), dtype=rfq_dtypes)
+    reference_df = read_with_parquet_cache(reference_path, usecols=REFERENCE_COLUMNS, dtype=reference_dtypes, sep='\t')
     
     logger.info(f"Loaded {len(rfq_df)} RFQ records with {rfq_df.shape[1]} columns")
     logger.info(f"Loaded {len(reference_df)} reference materials with {reference_df.shape[1]} properties")
@@ -37,6 +69,42 @@ def load_rfq_data():
     
     return rfq_df, reference_df
 
+def read_with_parquet_cache(source_path, usecols, dtype, **read_csv_kwargs):
+    """Read selected columns of a CSV/TSV file, using a parquet copy next to it when that copy is up to date."""
+    cache_path = source_path.with_suffix('.parquet')
+    
+    # The copy is only valid for the same columns read with the same dtypes
+    read_spec = json.dumps({col: str(pd.api.types.pandas_dtype(dtype[col])) for col in sorted(usecols)}).encode()
+    
+    if pq is not None and cache_path.exists() and cache_path.stat().st_mtime >= source_path.stat().st_mtime:
+        # Check the schema metadata before loading any data; an unreadable copy counts as a miss
+        try:
+            metadata = pq.read_schema(cache_path).metadata or {}
+            if metadata.get(CACHE_SPEC_KEY) == read_spec:
+                logger.info(f"Using cached {cache_path.name}")
+                return pd.read_parquet(cache_path)
+        except (pa.ArrowException, OSError) as e:
+            logger.warning(f"Ignoring unreadable cache {cache_path.name}: {e}")
+    
+    df = pd.read_csv(source_path, usecols=usecols, dtype=dtype, **read_csv_kwargs)
+    
+    # Caching is best effort: without pyarrow, for unsupported columns or in a read-only
+    # checkout keep the CSV result
+    if pq is not None:
+        # Written next to the copy and renamed over it, so an interrupted run never leaves a partial file
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), CACHE_SPEC_KEY: read_spec})
+            pq.write_table(table, tmp_path, compression='snappy')
+            os.replace(tmp_path, cache_path)
+        except (pa.ArrowException, ValueError, TypeError, OSError) as e:
+            logger.warning(f"Could not cache {source_path.name} as parquet: {e}")
+            if tmp_path.exists():
+                tmp_path.unlink()
+    
+    return df
+
 if __name__ == "__main__":
     # Quick test
     logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
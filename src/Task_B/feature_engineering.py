@@ -6,11 +6,12 @@ Creates interval features, categorical features, and property features for simil
 import pandas as pd
 import numpy as np
 import logging
-import warnings
+from numba import njit
 
-warnings.filterwarnings('ignore')
 logger = logging.getLogger(__name__)
 
+OVERLAP_EPS = 1e-12  # Added to the interval union so the overlap ratio needs no union > 0 branch
+
 def engineer_similarity_features(enriched_df):
     """
     Create engineered features for similarity calculation.
@@ -19,13 +20,15 @@ def engineer_similarity_features(enriched_df):
     - Categorical: Standardize for exact matching  
     - Grade properties: Use numeric midpoints, filter sparse features
     
+    Each step adds its new columns with a single concat rather than column by column.
+    
     Returns:
         DataFrame with engineered features and similarity functions
     """
     
     print("\n=== TASK B.2: Feature Engineering ===")
     
-    df_work = enriched_df.copy()
+    df_work = enriched_df
     
     # 1. Create dimension interval features
     df_work = create_dimension_intervals(df_work)
@@ -38,7 +41,7 @@ def engineer_similarity_features(enriched_df):
     
     # 4. Add similarity functions
     print("\n4. Defining Overlap Metrics...")
-    df_work.attrs['interval_overlap_ratio'] = interval_overlap_ratio
+    df_work.attrs['interval_overlap_ratio'] = overlap_ratio
     df_work.attrs['categorical_match'] = categorical_match
     print("  ✓ Interval overlap ratio function defined")
     print("  ✓ Categorical match function defined")
@@ -48,7 +51,7 @@ def engineer_similarity_features(enriched_df):
     
     # Count feature types
     interval_features = [col for col in df_work.columns if '_interval_' in col or '_center' in col or '_width' in col]
-    categorical_clean = [col for col in df_work.columns if '_clean' in col]
+    categorical_clean = [col for col in df_work.columns if col.endswith('_clean')]
     property_features = [col for col in df_work.columns if '_mid' in col]
     
     print(f"Interval features created: {len(interval_features)}")
@@ -74,16 +77,35 @@ def create_dimension_intervals(df):
         ('tensile_strength_min', 'tensile_strength_max')
     ]
     
-    for min_col, max_col in dimension_pairs:
-        if min_col in df.columns and max_col in df.columns:
-            feature_name = min_col.replace('_min', '').replace('_max', '')
-            
-            df[f"{feature_name}_interval_min"] = df[min_col]
-            df[f"{feature_name}_interval_max"] = df[max_col].fillna(df[min_col])
-            df[f"{feature_name}_center"] = (df[f"{feature_name}_interval_min"] + df[f"{feature_name}_interval_max"]) / 2
-            df[f"{feature_name}_width"] = df[f"{feature_name}_interval_max"] - df[f"{feature_name}_interval_min"]
-            
-            print(f"  Created interval features for {feature_name}")
+    available_pairs = [(min_col, max_col) for min_col, max_col in dimension_pairs
+                       if min_col in df.columns and max_col in df.columns]
+    if not available_pairs:
+        return df
+    
+    min_cols = [min_col for min_col, _ in available_pairs]
+    max_cols = [max_col for _, max_col in available_pairs]
+    feature_names = [min_col.replace('_min', '').replace('_max', '') for min_col in min_cols]
+    
+    # Compute all interval features as one (n_rows, n_features) block per kind
+    mins = df[min_cols].to_numpy(dtype=np.float64)
+    maxs = df[max_cols].to_numpy(dtype=np.float64)
+    maxs = np.where(np.isnan(maxs), mins, maxs)
+    centers = (mins + maxs) / 2
+    widths = maxs - mins
+    
+    # Interleave to keep min/max/center/width grouped per feature, then assign once
+    interval_block = np.stack([mins, maxs, centers, widths], axis=2).reshape(len(df), -1)
+    interval_cols = [
+        col
+        for name in feature_names
+        for col in (f"{name}_interval_min", f"{name}_interval_max", f"{name}_center", f"{name}_width")
+    ]
+    interval_df = pd.DataFrame(interval_block, columns=interval_cols, index=df.index)
+    df = pd.concat([df.drop(columns=interval_cols, errors='ignore'), interval_df], axis=1)
+    df = downcast_to_float32(df, interval_cols)
+    
+    for feature_name in feature_names:
+        print(f"  Created interval features for {feature_name}")
     
     return df
 
@@ -93,15 +115,33 @@ def standardize_categorical_features(df):
     print("\n2. Engineering Categorical Features...")
     
     categorical_features = ['coating', 'finish', 'form', 'surface_type', 'surface_protection']
+    new_columns = {}
     
     for cat_feature in categorical_features:
         if cat_feature in df.columns:
-            df[f"{cat_feature}_clean"] = df[cat_feature].fillna('Unknown').str.strip().str.upper()
-            unique_count = df[f'{cat_feature}_clean'].nunique()
+            cleaned = normalize_categorical_values(df[cat_feature].fillna('Unknown'))
+            
+            # String column kept for reporting, integer codes used for matching
+            new_columns[f"{cat_feature}_clean"] = cleaned.astype(object)
+            new_columns[f"{cat_feature}_clean_code"] = cleaned.cat.codes.astype('int16')
+            unique_count = len(cleaned.cat.categories)
             print(f"  Standardized {cat_feature}: {unique_count} unique values")
     
+    if new_columns:
+        df = pd.concat([df.drop(columns=list(new_columns), errors='ignore'), pd.DataFrame(new_columns, index=df.index)], axis=1)
+    
     return df
 
+def normalize_categorical_values(values):
+    """Strip and upper-case a string Series, transforming each distinct value only once."""
+    raw = values.astype('category')
+    
+    # Distinct raw values can collapse onto the same cleaned value ('oiled ' and 'OILED')
+    category_codes, cleaned_categories = pd.factorize(raw.cat.categories.str.strip().str.upper(), sort=True)
+    codes = np.append(category_codes, -1)[raw.cat.codes.to_numpy()]
+    
+    return pd.Series(pd.Categorical.from_codes(codes, categories=cleaned_categories), index=values.index)
+
 def prepare_grade_properties(df):
     """Filter and prepare grade property features based on data coverage."""
     
@@ -121,40 +161,67 @@ def prepare_grade_properties(df):
     # Filter features with sufficient data coverage (5% minimum)
     min_coverage = 10
     kept_features = []
+    dropped_features = []
     total_with_ref = df['Grade/Material'].notna().sum()
     
+    # Non-null counts for all property features in a single pass
+    present_features = [feature for feature in all_property_features if feature in df.columns]
+    non_null_counts = df[present_features].notna().sum()
+    
     print(f"\n  Grade Properties Availability and Filtering (min {min_coverage}% coverage):")
     
-    for feature in all_property_features:
-        if feature in df.columns:
-            non_null_count = df[feature].notna().sum()
-            coverage = non_null_count / total_with_ref * 100 if total_with_ref > 0 else 0
-            
-            if coverage >= min_coverage:
-                kept_features.append(feature)
-                status = "kept"
-            else:
-                df.drop(columns=[feature], inplace=True)
-                status = "dropped"
-            
-            print(f"    {feature}: {non_null_count}/{total_with_ref} ({coverage:.1f}%) {status}")
+    for feature, non_null_count in non_null_counts.items():
+        coverage = non_null_count / total_with_ref * 100 if total_with_ref > 0 else 0
+        
+        if coverage >= min_coverage:
+            kept_features.append(feature)
+            status = "kept"
+        else:
+            dropped_features.append(feature)
+            status = "dropped"
+        
+        print(f"    {feature}: {non_null_count}/{total_with_ref} ({coverage:.1f}%) {status}")
+    
+    df.drop(columns=dropped_features, inplace=True)
+    df = downcast_to_float32(df, kept_features)
     
     return df
 
-def interval_overlap_ratio(min1, max1, min2, max2):
-    """Calculate overlap ratio between two intervals."""
-    if pd.isna(min1) or pd.isna(max1) or pd.isna(min2) or pd.isna(max2):
-        return 0.0
+def downcast_to_float32(df, columns):
+    """Cast numeric columns to float32, skipping any whose values exceed the float32 range."""
+    float32_max = np.finfo(np.float32).max
+    safe_cols = []
+    
+    for col in columns:
+        values = df[col].to_numpy(dtype=np.float64)
+        finite = values[np.isfinite(values)]
+        if np.abs(finite).max(initial=0.0) <= float32_max:
+            safe_cols.append(col)
+        else:
+            logger.warning(f"Keeping {col} as float64: values exceed float32 range")
+    
+    if safe_cols:
+        df[safe_cols] = df[safe_cols].astype(np.float32)
     
-    # Ensure min <= max for both intervals
-    min1, max1 = min(min1, max1), max(min1, max1)
-    min2, max2 = min(min2, max2), max(min2, max2)
+    return df
+
+@njit(cache=True)
+def interval_overlap_ratio(min1, max1, min2, max2):
+    """Calculate overlap ratio between two intervals (branchless min/max, eps instead of a union > 0 test)."""
+    # Ensure min <= max for both intervals (np.minimum/np.maximum propagate NaN, builtin min/max don't)
+    lo1, hi1 = np.minimum(min1, max1), np.maximum(min1, max1)
+    lo2, hi2 = np.minimum(min2, max2), np.maximum(min2, max2)
     
-    # Calculate overlap
-    overlap = max(0, min(max1, max2) - max(min1, min2))
-    union = max(max1, max2) - min(min1, min2)
+    # Calculate overlap; an empty union has zero overlap, so eps just avoids 0/0
+    overlap = np.maximum(np.minimum(hi1, hi2) - np.maximum(lo1, lo2), 0.0)
+    ratio = overlap / (np.maximum(hi1, hi2) - np.minimum(lo1, lo2) + OVERLAP_EPS)
     
-    return overlap / union if union > 0 else 0.0
+    # NaN bounds (missing intervals) end up as NaN here and count as no overlap
+    return ratio if ratio == ratio else 0.0
+
+def overlap_ratio(min1, max1, min2, max2):
+    """Plain Python entry point to interval_overlap_ratio for df.attrs (pandas deep-copies attrs, a numba dispatcher is costly to copy)."""
+    return interval_overlap_ratio(min1, max1, min2, max2)
 
 def categorical_match(val1, val2):
     """Check if two categorical values match exactly."""
@@ -179,7 +246,7 @@ if __name__ == "__main__":
     print(f"Final dataset shape: {feature_df.shape}")
     
     # Debug: Show exactly which categorical features were created
-    categorical_clean_cols = [col for col in feature_df.columns if '_clean' in col]
+    categorical_clean_cols = [col for col in feature_df.columns if col.endswith('_clean')]
     print(f"\nDEBUG - The {len(categorical_clean_cols)} categorical '_clean' features are:")
     for i, col in enumerate(categorical_clean_cols, 1):
         count = feature_df[col].notna().sum()
@@ -6,31 +6,33 @@ Task B.1: Normalize grade keys (case, suffixes, aliases) and join RFQs with refe
 """
 
 import pandas as pd
+import numpy as np
 import re
 import logging
-import warnings
 from difflib import get_close_matches
+from sklearn.feature_extraction.text import HashingVectorizer
 
-warnings.filterwarnings('ignore')
 logger = logging.getLogger(__name__)
 
 def normalize_grades(rfq_df, reference_df):
     """
     Normalize grade names and join RFQ data with reference properties.
     
+    Adds grade_clean (and grade_mapped on rfq_df) to the input frames in place;
+    the enriched result is a new DataFrame with the reference columns appended.
+    
     Returns:
         tuple: (enriched_rfq_df, grade_mapping_dict)
     """
     
     print("\n=== TASK B.1: Grade Normalization and Reference Join ===")
 
-    # Work with copies
-    rfq_work = rfq_df.copy()
-    ref_work = reference_df.copy()
+    rfq_work = rfq_df
+    ref_work = reference_df
     
     # Clean and normalize grade strings
-    rfq_work['grade_clean'] = rfq_work['grade'].apply(clean_grade_string)
-    ref_work['grade_clean'] = ref_work['Grade/Material'].apply(clean_grade_string)
+    rfq_work['grade_clean'] = clean_grade_series(rfq_work['grade'])
+    ref_work['grade_clean'] = clean_grade_series(ref_work['Grade/Material'])
     
     # Remove duplicate reference entries (keep best match per grade)
     ref_clean = deduplicate_reference_data(ref_work)
@@ -90,24 +92,42 @@ def clean_grade_string(grade):
     
     return grade
 
+def clean_grade_series(grades):
+    """Vectorized clean_grade_string for a whole Series, cleaning each distinct grade once."""
+    categorical = grades.astype('category')
+    cleaned = categorical.cat.categories.astype(str).to_series()
+    cleaned = cleaned.str.strip().str.upper()
+    
+    # Remove delivery condition suffixes (+N, +QT, +C, etc.)
+    cleaned = cleaned.str.split('+', n=1).str[0]
+    
+    # Remove spaces and dashes
+    cleaned = cleaned.str.replace(' ', '', regex=False).str.replace('-', '', regex=False)
+    
+    # Handle common DX grade patterns (DX51 → DX51D)
+    is_short_dx = cleaned.str.match(r'^DX\d{2}$', na=False)
+    cleaned = cleaned.mask(is_short_dx, cleaned + 'D')
+    
+    # Broadcast back to rows; the extra NaN entry serves missing grades (code -1)
+    lookup = np.append(cleaned.to_numpy(dtype=object), np.nan)
+    return pd.Series(lookup[categorical.cat.codes.to_numpy()], index=grades.index, dtype=object)
+
 def deduplicate_reference_data(ref_df):
     """Remove duplicate reference entries, keeping the best one per grade."""
     
-    def select_best_entry(group):
-        if len(group) == 1:
-            return group.iloc[0]
-        
-        # Prefer entries with exact grade match to cleaned version
-        original_clean = group['Grade/Material'].str.upper().str.replace(' ', '').str.replace('-', '')
-        exact_matches = group[original_clean == group['grade_clean']]
-        
-        if len(exact_matches) > 0:
-            return exact_matches.iloc[0]
-        
-        # Otherwise pick shortest name (fewer suffixes)
-        return group.loc[group['Grade/Material'].str.len().idxmin()]
+    # Prefer entries with exact grade match to cleaned version
+    original_clean = ref_df['Grade/Material'].str.upper().str.replace(' ', '', regex=False).str.replace('-', '', regex=False)
+    is_exact = (original_clean == ref_df['grade_clean']).to_numpy()
+    
+    # Otherwise pick shortest name (fewer suffixes); exact matches rank first in file order
+    rank = np.where(is_exact, -1, ref_df['Grade/Material'].str.len().to_numpy())
+    
+    ranked = ref_df.assign(_rank=rank)
+    ranked = ranked[ranked['grade_clean'].notna()]
+    ranked = ranked.sort_values(['grade_clean', '_rank'], kind='stable')
     
-    return ref_df.groupby('grade_clean', group_keys=False).apply(select_best_entry).reset_index(drop=True)
+    best = ranked.drop_duplicates('grade_clean', keep='first').drop(columns='_rank')
+    return best.reset_index(drop=True)
 
 def create_grade_mapping(rfq_df, ref_df):
     """Create mapping from RFQ grades to reference grades."""
@@ -115,51 +135,89 @@ def create_grade_mapping(rfq_df, ref_df):
     rfq_grades = set(rfq_df['grade_clean'].dropna())
     ref_grades = set(ref_df['grade_clean'].dropna())
     
-    mapping = {}
-    
     # Direct matches first
-    for grade in rfq_grades:
-        if grade in ref_grades:
-            mapping[grade] = grade
+    mapping = {grade: grade for grade in rfq_grades & ref_grades}
     
     # Fuzzy matching for remaining grades
-    unmatched = rfq_grades - set(mapping.keys())
+    unmatched = sorted(rfq_grades - ref_grades)
+    ref_sorted = np.array(sorted(ref_grades), dtype=str)
+    ref_sorted_by_len = np.array(sorted(ref_grades, key=lambda g: (len(g), g)), dtype=str)
+    
+    # Character n-gram similarity for all unmatched grades in one sparse product
+    mapping.update(match_grades_by_ngrams(unmatched, ref_sorted_by_len, cutoff=0.8))
+    
     for grade in unmatched:
+        if grade in mapping:
+            continue
+        
         # Try close string matches
         matches = get_close_matches(grade, ref_grades, n=1, cutoff=0.8)
         if matches:
             mapping[grade] = matches[0]
             continue
         
-        # Try substring matching for known patterns
-        for ref_grade in ref_grades:
-            if len(grade) >= 4 and (grade in ref_grade or ref_grade in grade):
-                mapping[grade] = ref_grade
-                break
+        # Try substring matching for known patterns (shortest reference grade wins)
+        if len(grade) >= 4 and len(ref_sorted) > 0:
+            # Prefix relations (S235 ↔ S235JR) via binary search, general containment as fallback
+            match = find_prefix_match(grade, ref_sorted, ref_grades)
+            if match is None:
+                contains = (np.char.find(ref_sorted_by_len, grade) >= 0) | (np.char.find(grade, ref_sorted_by_len) >= 0)
+                if contains.any():
+                    match = str(ref_sorted_by_len[contains.argmax()])
+            if match is not None:
+                mapping[grade] = match
     
     logger.info(f"Created {len(mapping)} grade mappings from {len(rfq_grades)} unique RFQ grades")
     return mapping
 
+def find_prefix_match(grade, ref_sorted, ref_grades):
+    """Find the shortest reference grade that starts with grade or that grade starts with."""
+    
+    # Reference grades starting with grade form one contiguous block of the sorted array
+    start = np.searchsorted(ref_sorted, grade, side='left')
+    end = np.searchsorted(ref_sorted, grade + '\U0010ffff', side='left')
+    candidates = [str(ref_grade) for ref_grade in ref_sorted[start:end]]
+    
+    # Reference grades that are a prefix of grade: one set lookup per prefix length
+    candidates += [grade[:k] for k in range(1, len(grade)) if grade[:k] in ref_grades]
+    
+    return min(candidates, key=lambda g: (len(g), g)) if candidates else None
+
+def match_grades_by_ngrams(grades, ref_grades, cutoff=0.8):
+    """Map grades to their most similar reference grade by character n-gram cosine similarity."""
+    if len(grades) == 0 or len(ref_grades) == 0:
+        return {}
+    
+    vectorizer = HashingVectorizer(analyzer='char_wb', ngram_range=(2, 4), norm='l2', alternate_sign=False)
+    grade_vectors = vectorizer.transform(grades)
+    ref_vectors = vectorizer.transform(ref_grades)
+    
+    similarity = (grade_vectors @ ref_vectors.T).toarray()
+    best_idx = similarity.argmax(axis=1)
+    best_score = similarity.max(axis=1)
+    
+    return {
+        grade: str(ref_grades[idx])
+        for grade, idx, score in zip(grades, best_idx, best_score)
+        if score >= cutoff
+    }
+
 def join_with_reference(rfq_df, ref_df, grade_mapping):
     """Join RFQ data with reference data using grade mapping."""
     
     # Apply mapping
     rfq_df['grade_mapped'] = rfq_df['grade_clean'].map(grade_mapping)
     
-    # Join datasets
-    enriched = rfq_df.merge(
-        ref_df,
-        left_on='grade_mapped',
-        right_on='grade_clean',
-        how='left',
-        suffixes=('', '_ref')
-    )
-    
-    # Clean up redundant columns
-    cols_to_drop = [col for col in enriched.columns if col.endswith('_ref')]
-    enriched = enriched.drop(columns=cols_to_drop)
-    
-    return enriched
+    # Reference grades are unique after deduplication, so one index lookup
+    # gives the matching reference row (or NaN) for every RFQ
+    ref_indexed = ref_df.set_index('grade_clean')
+    ref_rows = ref_indexed.reindex(rfq_df['grade_mapped'].to_numpy())
+    
+    # Redundant columns already present on the RFQ side are not added
+    ref_columns = [col for col in ref_indexed.columns if col not in rfq_df.columns]
+    ref_rows = ref_rows[ref_columns].set_axis(rfq_df.index)
+    
+    return pd.concat([rfq_df, ref_rows], axis=1)
 
 if __name__ == "__main__":
     from data_loader import load_rfq_data
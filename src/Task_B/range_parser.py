@@ -4,17 +4,35 @@ Converts string ranges like "≤0.17", "360-510 MPa" into numeric min/max/mid va
 """
 
 import pandas as pd
+import numpy as np
 import re
 import logging
-import warnings
 
-warnings.filterwarnings('ignore')
 logger = logging.getLogger(__name__)
 
+# RE2 (linear-time DFA matching) when google-re2 is installed. It only serves the scalar
+# parse_single_range, which the pipeline no longer calls and is kept for compatibility;
+# parse_range_series goes through pandas .str methods, which need stdlib re patterns
+try:
+    import re2 as scalar_regex
+except ImportError:
+    scalar_regex = re
+
+# Patterns for the vectorized parser (UNIT_PATTERN is shared with the scalar parser)
+UNIT_PATTERN = re.compile(r'[A-Za-z%°]')
+RANGE_NUMBERS_PATTERN = re.compile(r'^[^\d.]*(?P<a>[\d.]+)(?:[^\d.]+(?P<b>[\d.]+))?')
+
+# Patterns for the scalar parser
+WHITESPACE_PATTERN = scalar_regex.compile(r'\s+')
+NUMBER_PATTERN = scalar_regex.compile(r'[\d.]+')
+
 def parse_range_strings(enriched_df):
     """
     Parse range strings into numeric min/max/mid values.
     
+    All parsed columns are collected into one float32 block and joined to
+    enriched_df with a single concat, instead of being inserted one by one.
+    
     Args:
         enriched_df: DataFrame with reference properties as strings
         
@@ -24,7 +42,7 @@ def parse_range_strings(enriched_df):
     
     print("\n=== TASK B.1: Range String Parsing ===")
 
-    df_work = enriched_df.copy()
+    df_work = enriched_df
     
     # Define properties to parse
     chemical_props = [
@@ -40,6 +58,8 @@ def parse_range_strings(enriched_df):
     
     properties_to_parse = chemical_props + mechanical_props
     parsed_count = 0
+    parsed_blocks = []
+    parsed_columns = []
     
     # Parse each property
     for prop in properties_to_parse:
@@ -52,25 +72,70 @@ def parse_range_strings(enriched_df):
             max_col = f"{prop_clean}_max"
             mid_col = f"{prop_clean}_mid"
             
-            # Parse values
-            parsed_values = df_work[prop].apply(parse_single_range)
+            # Parse each distinct string once, then broadcast back via category codes
+            categorical = df_work[prop].astype('category')
+            parsed_categories = parse_range_series(categorical.cat.categories.to_series())
+            
+            # Extra all-NaN row so missing values (code -1) index to NaN
+            lookup = np.vstack([parsed_categories, np.full((1, 3), np.nan)]).astype(np.float32)
+            parsed_values = lookup[categorical.cat.codes.to_numpy()]
             
-            df_work[min_col] = [x[0] for x in parsed_values]
-            df_work[max_col] = [x[1] for x in parsed_values]
-            df_work[mid_col] = [x[2] for x in parsed_values]
+            parsed_blocks.append(parsed_values)
+            parsed_columns.extend([min_col, max_col, mid_col])
             
             # Report success rate
-            successful = df_work[mid_col].notna().sum()
+            successful = np.count_nonzero(~np.isnan(parsed_values[:, 2]))
             total_available = df_work[prop].notna().sum()
             print(f"  Successfully parsed {successful}/{total_available} values")
             
             parsed_count += 1
     
+    # Add all min/max/mid columns at once
+    if parsed_blocks:
+        parsed_df = pd.DataFrame(np.hstack(parsed_blocks), columns=parsed_columns, index=df_work.index)
+        df_work = pd.concat([df_work.drop(columns=parsed_columns, errors='ignore'), parsed_df], axis=1)
+    
     print(f"Total properties parsed: {parsed_count}")
     print(f"Final dataset shape: {df_work.shape}")
 
     return df_work
 
+def parse_range_series(values):
+    """
+    Vectorized version of parse_single_range for a whole Series.
+    
+    Extracts the first two numbers of every unit-stripped string in one
+    regex pass and derives min/max/mid with numpy masks instead of
+    calling parse_single_range per cell.
+    
+    Returns:
+        np.ndarray: shape (len(values), 3) with min, max, mid columns (NaN if unparseable)
+    """
+    
+    raw = values.astype('string').str.strip()
+    clean = raw.str.replace(UNIT_PATTERN, '', regex=True)  # Remove units
+    
+    numbers = clean.str.extract(RANGE_NUMBERS_PATTERN).astype(object)
+    a = pd.to_numeric(numbers['a'], errors='coerce').to_numpy(dtype=np.float64)
+    b = pd.to_numeric(numbers['b'], errors='coerce').to_numpy(dtype=np.float64)
+    
+    # Same precedence as parse_single_range: ≤, then ≥, then X-Y, then single number
+    is_upper = raw.str.contains('≤|<=', regex=True).fillna(False).to_numpy(dtype=bool)
+    is_lower = raw.str.contains('≥|>=', regex=True).fillna(False).to_numpy(dtype=bool) & ~is_upper
+    is_range = clean.str.contains('[-–]', regex=True).fillna(False).to_numpy(dtype=bool) & ~is_upper & ~is_lower
+    is_single = ~is_upper & ~is_lower & ~is_range
+    
+    # A range needs both ends, otherwise the whole value is unparseable
+    valid_range = is_range & ~np.isnan(a) & ~np.isnan(b)
+    
+    min_vals = np.where(is_lower, a, np.where(valid_range, a, np.nan))
+    max_vals = np.where(is_upper, a, np.where(valid_range, b, np.nan))
+    mid_vals = np.where(is_upper, a / 2,
+               np.where(valid_range, (a + b) / 2,
+               np.where(is_single, a, np.nan)))
+    
+    return np.column_stack([min_vals, max_vals, mid_vals])
+
 def parse_single_range(value_str):
     """
     Parse a single range string into (min_val, max_val, mid_val).
@@ -90,24 +155,24 @@ def parse_single_range(value_str):
     
     # Clean the string
     value_str = str(value_str).strip()
-    clean_str = re.sub(r'[A-Za-z%°]', '', value_str)  # Remove units
-    clean_str = re.sub(r'\s+', ' ', clean_str).strip()
+    clean_str = UNIT_PATTERN.sub('', value_str)  # Remove units
+    clean_str = WHITESPACE_PATTERN.sub(' ', clean_str).strip()
     
     try:
         # Pattern 1: ≤X or <=X (upper bound only)
         if '≤' in value_str or '<=' in value_str:
-            max_val = float(re.findall(r'[\d.]+', clean_str)[0])
+            max_val = float(NUMBER_PATTERN.findall(clean_str)[0])
             mid_val = max_val / 2
             return None, max_val, mid_val
         
         # Pattern 2: ≥X or >=X (lower bound only)
         elif '≥' in value_str or '>=' in value_str:
-            min_val = float(re.findall(r'[\d.]+', clean_str)[0])
+            min_val = float(NUMBER_PATTERN.findall(clean_str)[0])
             return min_val, None, None
         
         # Pattern 3: X-Y or X–Y (range)
         elif '-' in clean_str or '–' in clean_str:
-            numbers = re.findall(r'[\d.]+', clean_str)
+            numbers = NUMBER_PATTERN.findall(clean_str)
             if len(numbers) >= 2:
                 min_val = float(numbers[0])
                 max_val = float(numbers[1])
@@ -116,7 +181,7 @@ def parse_single_range(value_str):
         
         # Pattern 4: Single number
         else:
-            numbers = re.findall(r'[\d.]+', clean_str)
+            numbers = NUMBER_PATTERN.findall(clean_str)
             if numbers:
                 val = float(numbers[0])
                 return None, None, val
@@ -6,11 +6,33 @@ Calculates weighted aggregate similarity scores between RFQs.
 import pandas as pd
 import numpy as np
 import logging
-import warnings
+from numba import njit
+from joblib import Parallel, delayed
+from scipy.spatial.distance import cdist
+
+from feature_engineering import interval_overlap_ratio
 
-warnings.filterwarnings('ignore')
 logger = logging.getLogger(__name__)
 
+TOP_K = 3         # Matches kept per RFQ
+TILE_SIZE = 128   # RFQ rows scored per kernel call
+PROGRESS_LOG_MIN_RFQS = 5000  # Log progress per tile only above this many RFQs
+
+# Above this many RFQs, only candidates sharing a blocking key are scored (approximate top-3)
+BLOCKING_MIN_RFQS = 20000
+MIN_BLOCK_CANDIDATES = 200  # Rows with fewer blocked candidates are still scored against all RFQs
+BLOCKING_KEYS = [['thickness'], ['width'], ['grade_family']]  # Columns of build_blocks' coordinates, one block key each
+
+# Dimension features (use the most reliable ones with good coverage)
+DIMENSION_FEATURES = [
+    ('thickness_interval_min', 'thickness_interval_max'),    # 833 values
+    ('width_interval_min', 'width_interval_max'),           # 539 values  
+    ('weight_interval_min', 'weight_interval_max'),         # 393 values
+    ('inner_diameter_interval_min', 'inner_diameter_interval_max'), # 177 values
+    ('length_interval_min', 'length_interval_max'),         # 131 values
+    ('height_interval_min', 'height_interval_max')          # 132 values
+]
+
 def calculate_rfq_similarity(feature_df):
     """
     Calculate aggregate similarity scores between RFQs.
@@ -20,27 +42,13 @@ def calculate_rfq_similarity(feature_df):
     
     print("\n=== TASK B.3: Similarity Calculation ===")
     
-    # Get similarity functions
-    interval_overlap_ratio = feature_df.attrs['interval_overlap_ratio']
-    categorical_match = feature_df.attrs['categorical_match']
-    
     # Extract available features directly from the dataframe
-    # Dimension features (use the most reliable ones with good coverage)
-    dimension_features = [
-        ('thickness_interval_min', 'thickness_interval_max'),    # 833 values
-        ('width_interval_min', 'width_interval_max'),           # 539 values  
-        ('weight_interval_min', 'weight_interval_max'),         # 393 values
-        ('inner_diameter_interval_min', 'inner_diameter_interval_max'), # 177 values
-        ('length_interval_min', 'length_interval_max'),         # 131 values
-        ('height_interval_min', 'height_interval_max')          # 132 values
-    ]
-
-    # Filter to only those that exist in dataframe
-    dimension_features = [(min_col, max_col) for min_col, max_col in dimension_features 
+    # Dimension features, filtered to only those that exist in dataframe
+    dimension_features = [(min_col, max_col) for min_col, max_col in DIMENSION_FEATURES 
                          if min_col in feature_df.columns and max_col in feature_df.columns]
     
-    # Categorical features (exclude grade_clean as it's for matching, not similarity)
-    categorical_features = [col for col in feature_df.columns if '_clean' in col and col != 'grade_clean']
+    # Categorical features as integer codes (grade_clean has no code column, it's for matching, not similarity)
+    categorical_features = [col for col in feature_df.columns if col.endswith('_clean_code')]
     
     # Grade property features (all _mid columns that have data)
     grade_property_features = [col for col in feature_df.columns if '_mid' in col and feature_df[col].notna().sum() > 0]
@@ -52,130 +60,363 @@ def calculate_rfq_similarity(feature_df):
         'grade_properties': 0.30 # 30% - high but less critical
     }
     
-    print(f"Feature groups defined:")
-    print(f"  Dimensions: {len(dimension_features)} features (weight: {weights['dimensions']})")
-    print(f"  Categorical: {len(categorical_features)} features (weight: {weights['categorical']})")
-    print(f"  Grade properties: {len(grade_property_features)} features (weight: {weights['grade_properties']})")
+    logger.info(f"Feature groups: {len(dimension_features)} dimensions (weight {weights['dimensions']}), "
+                f"{len(categorical_features)} categorical (weight {weights['categorical']}), "
+                f"{len(grade_property_features)} grade properties (weight {weights['grade_properties']})")
     
     # Filter valid RFQs
-    valid_df = feature_df[feature_df['id'].notna()].copy().reset_index(drop=True)
-    print(f"\nCalculating pairwise similarities for {len(valid_df)} RFQs...")
+    valid_df = feature_df[feature_df['id'].notna()].reset_index(drop=True)
+    logger.info(f"Calculating pairwise similarities for {len(valid_df)} RFQs")
     
-    # Calculate similarities
-    similarity_results = []
-    batch_size = 50
+    arrays = prepare_similarity_arrays(valid_df, feature_df, dimension_features, categorical_features, grade_property_features)
+    n = len(valid_df)
+    
+    # Top-3 per RFQ with its score components, filled tile by tile by the fused kernel
+    best_idx = np.full((n, TOP_K), -1, dtype=np.int64)
+    best_scores = np.full((n, TOP_K), -np.inf, dtype=np.float32)
+    best_components = np.zeros((n, TOP_K, 3), dtype=np.float32)
+    weight_values = np.array([weights['dimensions'], weights['categorical'], weights['grade_properties']], dtype=np.float32)
     
-    print("Computing similarities...")
+    # Tiles run on a thread pool: the kernels release the GIL and the feature arrays are shared
+    # without pickling
+    tile_starts = range(0, n, TILE_SIZE)
+    if n > BLOCKING_MIN_RFQS:
+        # Large inputs: LSH-style blocking instead of all N^2 pairs. Candidate sets are per row (rows
+        # with small blocks fall back to all RFQs), so each tile scores only its own rows, in place
+        block_ids, block_ptr, block_members = build_blocks(valid_df)
+        logger.info(f"Blocking prefilter: {len(block_ptr) - 1} blocks over {block_ids.shape[1]} keys")
+        tasks = (
+            delayed(score_rows_top_k)(
+                arrays['dim_mins'], arrays['dim_maxs'], arrays['dim_valid_bits'], arrays['cat_codes'],
+                arrays['prop_groups'], arrays['prop_table'], arrays['duplicate_keys'], weight_values,
+                block_ids, block_ptr, block_members, MIN_BLOCK_CANDIDATES,
+                start, min(start + TILE_SIZE, n), best_idx, best_scores, best_components
+            )
+            for start in tile_starts
+        )
+    else:
+        # Exact: each tile scores its rows against the later rows only, so every symmetric pair is
+        # computed once and offered to both RFQs through a per-tile top-3 table
+        tasks = (delayed(score_tile_pairs)(arrays, weight_values, start, min(start + TILE_SIZE, n)) for start in tile_starts)
     
-    for i in range(0, len(valid_df), batch_size):
-        end_i = min(i + batch_size, len(valid_df))
+    tiles = Parallel(n_jobs=-1, prefer='threads', return_as='generator')(tasks)
+    
+    for start, tile in zip(tile_starts, tiles):
+        end = min(start + TILE_SIZE, n)
         
-        for idx1 in range(i, end_i):
-            row1 = valid_df.iloc[idx1]
-            rfq1_id = row1['id']
-            
-            rfq_similarities = []
-            
-            for idx2 in range(len(valid_df)):
-                if idx1 != idx2:
-                    row2 = valid_df.iloc[idx2]
-                    rfq2_id = row2['id']
-                    
-                    # Skip exact duplicates
-                    if (row1['grade'] == row2['grade'] and 
-                        row1['thickness_center'] == row2['thickness_center'] and
-                        row1['width_center'] == row2['width_center']):
-                        continue
-                    
-                    # Calculate similarity components
-                    dim_sim = calculate_dimension_similarity(row1, row2, dimension_features, interval_overlap_ratio)
-                    cat_sim = calculate_categorical_similarity(row1, row2, categorical_features, categorical_match)
-                    prop_sim = calculate_grade_property_similarity(row1, row2, grade_property_features, feature_df)
-                    
-                    # Calculate weighted aggregate score
-                    aggregate_score = (
-                        weights['dimensions'] * dim_sim +
-                        weights['categorical'] * cat_sim +
-                        weights['grade_properties'] * prop_sim
-                    )
-                    
-                    rfq_similarities.append({
-                        'rfq_id': rfq1_id,
-                        'match_id': rfq2_id,
-                        'similarity_score': aggregate_score,
-                        'dimension_similarity': dim_sim,
-                        'categorical_similarity': cat_sim,
-                        'property_similarity': prop_sim
-                    })
-            
-            # Get top-3 most similar for this RFQ
-            if rfq_similarities:
-                rfq_similarities.sort(key=lambda x: x['similarity_score'], reverse=True)
-                top3 = rfq_similarities[:3]
-                similarity_results.extend(top3)
+        # Per-tile tables are merged here on the main thread, so no two threads write the same rows
+        if tile is not None:
+            merge_top_k(best_idx, best_scores, best_components, start, *tile)
         
-        # Progress update
-        progress = (end_i / len(valid_df)) * 100
-        print(f"  Progress: {progress:.1f}% ({end_i}/{len(valid_df)} RFQs processed)")
+        # Progress update (only worth a line per tile on large inputs)
+        if n > PROGRESS_LOG_MIN_RFQS:
+            logger.info(f"Progress: {end / n * 100:.1f}% ({end}/{n} RFQs processed)")
     
-    print("✓ Completed similarity calculations")
+    # Create results dataframe straight from the top-3 arrays (RFQs with fewer candidates leave -inf slots)
+    ids = valid_df['id'].to_numpy()
+    found = best_scores.ravel() > -np.inf
+    components = best_components.reshape(-1, 3)[found]
     
-    # Create results dataframe
-    results_df = pd.DataFrame(similarity_results)
-    print(f"\nSimilarity results shape: {results_df.shape}")
-    print(f"Average similarity score: {results_df['similarity_score'].mean():.3f}")
-    print(f"Max similarity score: {results_df['similarity_score'].max():.3f}")
+    results_df = pd.DataFrame({
+        'rfq_id': np.repeat(ids, TOP_K)[found],
+        'match_id': ids[best_idx.ravel()[found]],
+        'similarity_score': best_scores.ravel()[found],
+        'dimension_similarity': components[:, 0],
+        'categorical_similarity': components[:, 1],
+        'property_similarity': components[:, 2]
+    })
+    logger.info(f"Completed similarity calculations: {len(results_df)} pairs, "
+                f"average score {results_df['similarity_score'].mean():.3f}, max {results_df['similarity_score'].max():.3f}")
     
-    # Show top results
-    print(f"\nTop 10 highest similarity pairs:")
-    top_results = results_df.nlargest(10, 'similarity_score')
-    print(top_results[['rfq_id', 'match_id', 'similarity_score', 'dimension_similarity', 
-                      'categorical_similarity', 'property_similarity']].to_string())
+    # Show top results (only formatted when debug logging is on)
+    if logger.isEnabledFor(logging.DEBUG):
+        scores = results_df['similarity_score'].to_numpy()
+        lines = [f"{'rfq_id':<36} {'match_id':<36} {'score':>7} {'dims':>7} {'categ':>7} {'props':>7}"]
+        for pos in top_n_positions(scores, 10):
+            lines.append(f"{results_df['rfq_id'].iat[pos]:<36} {results_df['match_id'].iat[pos]:<36} {scores[pos]:7.3f} "
+                         f"{components[pos, 0]:7.3f} {components[pos, 1]:7.3f} {components[pos, 2]:7.3f}")
+        logger.debug("Top 10 highest similarity pairs:\n" + "\n".join(lines))
     
     return results_df
 
-def calculate_dimension_similarity(row1, row2, dimension_features, interval_overlap_ratio):
-    """Calculate dimensional similarity using interval overlap."""
-    similarities = []
+def top_n_positions(scores, top_n):
+    """
+    Positions of the top_n highest scores, best first, without sorting all of them.
     
-    for min_col, max_col in dimension_features:
-        if min_col in row1.index and max_col in row1.index:
-            overlap = interval_overlap_ratio(
-                row1[min_col], row1[max_col],
-                row2[min_col], row2[max_col]
-            )
-            similarities.append(overlap)
+    np.partition finds the cut-off score in O(M); only scores at or above it are sorted.
+    Ties are taken in original order, so the selection matches DataFrame.nlargest(keep='first').
+    """
+    top_n = min(top_n, len(scores))
+    if top_n == 0:
+        return np.empty(0, dtype=np.int64)
+    
+    cutoff = -np.partition(-scores, top_n - 1)[top_n - 1]
+    candidates = np.flatnonzero(scores >= cutoff)
+    return candidates[np.argsort(-scores[candidates], kind='stable')][:top_n]
+
+def prepare_similarity_arrays(df, range_df, dimension_features, categorical_features, grade_property_features):
+    """Extract the feature groups used for similarity into plain numpy arrays (one row per RFQ, float32/int16)."""
+    
+    # Property ranges computed once over the full dataset; properties without spread are skipped
+    ranges = (range_df[grade_property_features].max() - range_df[grade_property_features].min()).to_numpy(dtype=np.float32)
+    usable = ranges > 0
+    
+    dim_mins = df[[min_col for min_col, _ in dimension_features]].to_numpy(dtype=np.float32)
+    dim_maxs = df[[max_col for _, max_col in dimension_features]].to_numpy(dtype=np.float32)
+    
+    # Bit d set when the row has a complete interval for dimension feature d
+    dim_valid = ~np.isnan(dim_mins) & ~np.isnan(dim_maxs)
+    dim_valid_bits = (dim_valid.astype(np.int64) << np.arange(dim_valid.shape[1], dtype=np.int64)).sum(axis=1)
+    
+    return {
+        'dim_mins': dim_mins,
+        'dim_maxs': dim_maxs,
+        'dim_valid_bits': dim_valid_bits,
+        'cat_codes': np.ascontiguousarray(df[categorical_features].to_numpy(dtype=np.int16)),
+        **property_similarity_table(df[grade_property_features].to_numpy(dtype=np.float32)[:, usable], ranges[usable]),
+        'duplicate_keys': duplicate_keys(df),
+    }
+
+def duplicate_keys(df):
+    """
+    One int64 key per RFQ: rows sharing grade, thickness_center and width_center share a key.
+    
+    Rows with a missing grade or center never equal anything but themselves, so they get a unique key.
+    """
+    key_columns = ['grade', 'thickness_center', 'width_center']
+    hashes = pd.util.hash_pandas_object(df[key_columns], index=False).to_numpy()
+    keys = pd.factorize(hashes)[0].astype(np.int64)
+    
+    incomplete = df[key_columns].isna().any(axis=1).to_numpy()
+    keys[incomplete] = -1 - np.flatnonzero(incomplete)
+    return keys
+
+def property_similarity_table(values, ranges):
+    """
+    Property similarity between all distinct property rows, plus each RFQ's row in that table.
+    
+    Properties come from the matched reference grade, so there are far fewer distinct rows
+    than RFQs. Rows are grouped by which properties they have; for each pair of groups the
+    shared properties are scaled by 1/range and one cityblock cdist gives sum(|diff|/range),
+    so the mean of 1 - |diff|/range over shared properties is 1 - distance/count.
+    """
+    if values.shape[1] == 0:
+        return {'prop_groups': np.zeros(len(values), dtype=np.int64), 'prop_table': np.zeros((1, 1), dtype=np.float32)}
+    
+    row_hashes = pd.util.hash_pandas_object(pd.DataFrame(values), index=False).to_numpy()
+    prop_groups = pd.factorize(row_hashes)[0]
+    unique_values = values[np.unique(prop_groups, return_index=True)[1]] / ranges
+    
+    present = ~np.isnan(unique_values)
+    patterns, pattern_of_row = np.unique(present, axis=0, return_inverse=True)
+    pattern_of_row = pattern_of_row.ravel()
+    
+    table = np.zeros((len(unique_values), len(unique_values)), dtype=np.float32)
+    for a, pattern_a in enumerate(patterns):
+        rows_a = np.flatnonzero(pattern_of_row == a)
+        for b, pattern_b in enumerate(patterns):
+            shared = pattern_a & pattern_b
+            if not shared.any():
+                continue
+            rows_b = np.flatnonzero(pattern_of_row == b)
+            
+            distance = cdist(unique_values[np.ix_(rows_a, shared)], unique_values[np.ix_(rows_b, shared)], 'cityblock')
+            table[np.ix_(rows_a, rows_b)] = np.clip(1 - distance / shared.sum(), 0, 1)
+    
+    return {'prop_groups': prop_groups, 'prop_table': table}
+
+def build_blocks(df):
+    """
+    Blocks for the candidate prefilter, one per value of each BLOCKING_KEYS entry.
+    
+    Coordinates are the thickness bucket (1 mm), width bucket (100 mm) and grade family
+    (first two characters of grade_clean); candidates of a row are the rows sharing at least
+    one of its blocks. Returns per-row block ids (n, n_keys; -1 where a key field is missing)
+    and the block members in CSR form (block_ptr, block_members sorted by row), with one
+    extra last block holding all rows for the exact fallback.
+    """
+    coordinates = pd.DataFrame({
+        'thickness': df['thickness_center'].round(0),
+        'width': df['width_center'].round(-2),
+        'grade_family': df['grade_clean'].str[:2]
+    })
+    
+    block_ids = np.full((len(df), len(BLOCKING_KEYS)), -1, dtype=np.int64)
+    n_blocks = 0
+    for q, columns in enumerate(BLOCKING_KEYS):
+        complete = coordinates[columns].notna().all(axis=1).to_numpy()
+        hashes = pd.util.hash_pandas_object(coordinates.loc[complete, columns], index=False).to_numpy()
+        codes = pd.factorize(hashes)[0]
+        block_ids[complete, q] = codes + n_blocks
+        n_blocks += len(np.unique(codes))
+    
+    rows = np.repeat(np.arange(len(df)), len(BLOCKING_KEYS))
+    blocks = block_ids.ravel()
+    keep = blocks >= 0
+    rows, blocks = rows[keep], blocks[keep]
     
-    return np.mean(similarities) if similarities else 0.0
+    order = np.lexsort((rows, blocks))
+    block_ptr = np.concatenate([[0], np.cumsum(np.bincount(blocks, minlength=n_blocks)), [len(rows) + len(df)]])
+    return block_ids, block_ptr, np.concatenate([rows[order], np.arange(len(df))])
 
-def calculate_categorical_similarity(row1, row2, categorical_features, categorical_match):
-    """Calculate categorical similarity using exact matches."""
-    matches = []
+def score_tile_pairs(arrays, weights, row_start, row_end):
+    """
+    Top-k table of one exact tile: pairs (i, j) with i in [row_start, row_end) and j > i.
     
-    for cat_feature in categorical_features:
-        if cat_feature in row1.index:
-            match = categorical_match(row1[cat_feature], row2[cat_feature])
-            matches.append(match)
+    Row r of the returned (idx, scores, components) arrays belongs to RFQ row_start + r; tile rows
+    collect their later matches and every row from row_start on collects its matches from the tile.
+    """
+    n_rows = len(arrays['duplicate_keys']) - row_start
+    top_idx = np.full((n_rows, TOP_K), -1, dtype=np.int64)
+    top_scores = np.full((n_rows, TOP_K), -np.inf, dtype=np.float32)
+    top_components = np.zeros((n_rows, TOP_K, 3), dtype=np.float32)
     
-    return np.mean(matches) if matches else 0.0
+    score_pairs_top_k(arrays['dim_mins'], arrays['dim_maxs'], arrays['dim_valid_bits'], arrays['cat_codes'],
+                      arrays['prop_groups'], arrays['prop_table'], arrays['duplicate_keys'], weights,
+                      row_start, row_end, top_idx, top_scores, top_components)
+    return top_idx, top_scores, top_components
 
-def calculate_grade_property_similarity(row1, row2, grade_property_features, df):
-    """Calculate grade property similarity using normalized differences."""
-    similarities = []
+@njit(nogil=True, cache=True)
+def score_pairs_top_k(dim_mins, dim_maxs, dim_valid_bits, cat_codes, prop_groups, prop_table, keys, weights,
+                      row_start, row_end, top_idx, top_scores, top_components):
+    """
+    Score each pair (i, j) with i in [row_start, row_end) and j > i once and offer it to both rows.
+    
+    Each kept match carries its index, score and (dimension, categorical, property) similarity.
+    
+    Dimension, categorical and property similarity plus the weighting are fused into one pass
+    per pair, so no N x M intermediates are allocated. top_* are indexed by row - row_start and
+    are private to the tile, so the kernel runs without the GIL. All per-pair values are float32.
+    """
+    n = len(keys)
+    n_dims, n_cats = dim_mins.shape[1], cat_codes.shape[1]
     
-    for prop_feature in grade_property_features:
-        if prop_feature in row1.index:
-            val1, val2 = row1[prop_feature], row2[prop_feature]
+    for i in range(row_start, row_end):
+        for j in range(i + 1, n):
+            # Exact duplicates share a key
+            if keys[i] == keys[j]:
+                continue
+            
+            # Overlap only for features both rows have; missing ones add 0 but still count in the mean
+            shared_dims = dim_valid_bits[i] & dim_valid_bits[j]
+            dim_total = np.float32(0.0)
+            if shared_dims != 0:
+                for d in range(n_dims):
+                    if (shared_dims >> d) & 1:
+                        dim_total += np.float32(interval_overlap_ratio(dim_mins[i, d], dim_maxs[i, d], dim_mins[j, d], dim_maxs[j, d]))
+            dim_sim = dim_total / np.float32(max(n_dims, 1))
+            
+            cat_matches = 0
+            for c in range(n_cats):
+                if cat_codes[i, c] >= 0 and cat_codes[i, c] == cat_codes[j, c]:
+                    cat_matches += 1
+            cat_sim = np.float32(cat_matches) / np.float32(max(n_cats, 1))
             
-            if pd.notna(val1) and pd.notna(val2):
-                # Normalize by feature range
-                feature_range = df[prop_feature].max() - df[prop_feature].min()
-                if feature_range > 0:
-                    normalized_diff = abs(val1 - val2) / feature_range
-                    similarity = max(0, 1 - normalized_diff)
-                    similarities.append(similarity)
+            prop_sim = prop_table[prop_groups[i], prop_groups[j]]
+            score = weights[0] * dim_sim + weights[1] * cat_sim + weights[2] * prop_sim
+            
+            # Cheap pre-check first: most pairs make neither row's top-k
+            if score >= top_scores[i - row_start, TOP_K - 1]:
+                insert_top_k(top_idx, top_scores, top_components, i - row_start, j, score, dim_sim, cat_sim, prop_sim)
+            if score >= top_scores[j - row_start, TOP_K - 1]:
+                insert_top_k(top_idx, top_scores, top_components, j - row_start, i, score, dim_sim, cat_sim, prop_sim)
+
+@njit(nogil=True, cache=True)
+def score_rows_top_k(dim_mins, dim_maxs, dim_valid_bits, cat_codes, prop_groups, prop_table, keys, weights,
+                     block_ids, block_ptr, block_members, min_candidates,
+                     row_start, row_end, best_idx, best_scores, best_components):
+    """
+    Score rows [row_start, row_end) against their blocked candidates and keep the top-k per row.
+    
+    Candidates are the rows sharing one of the row's blocks (see build_blocks), or all RFQs
+    (the last block) when those hold fewer than min_candidates rows. Since that fallback is per
+    row, a pair is scored from each side that has the other as a candidate and each row only
+    writes its own entries of the preallocated best_* arrays, so tiles can run on parallel threads.
+    All per-pair values are float32.
+    """
+    n_dims, n_cats = dim_mins.shape[1], cat_codes.shape[1]
+    n_keys = block_ids.shape[1]
+    all_rows_block = len(block_ptr) - 2
     
-    return np.mean(similarities) if similarities else 0.0
+    for i in range(row_start, row_end):
+        n_candidates = 0
+        for q in range(n_keys):
+            if block_ids[i, q] >= 0:
+                n_candidates += block_ptr[block_ids[i, q] + 1] - block_ptr[block_ids[i, q]]
+        exact = n_candidates < min_candidates
+        
+        # Candidate sources: the last block (all RFQs), or each of the row's blocks in turn
+        for q in range(1 if exact else n_keys):
+            block = all_rows_block if exact else block_ids[i, q]
+            if block < 0:
+                continue
+            
+            for m in range(block_ptr[block], block_ptr[block + 1]):
+                j = block_members[m]
+                
+                # Self-matches and exact duplicates share a key
+                if keys[i] == keys[j]:
+                    continue
+                
+                # Skip rows already offered through an earlier block
+                seen = False
+                for earlier in range(q):
+                    if block_ids[i, earlier] >= 0 and block_ids[i, earlier] == block_ids[j, earlier]:
+                        seen = True
+                if seen:
+                    continue
+                
+                # Overlap only for features both rows have; missing ones add 0 but still count in the mean
+                shared_dims = dim_valid_bits[i] & dim_valid_bits[j]
+                dim_total = np.float32(0.0)
+                if shared_dims != 0:
+                    for d in range(n_dims):
+                        if (shared_dims >> d) & 1:
+                            dim_total += np.float32(interval_overlap_ratio(dim_mins[i, d], dim_maxs[i, d], dim_mins[j, d], dim_maxs[j, d]))
+                dim_sim = dim_total / np.float32(max(n_dims, 1))
+                
+                cat_matches = 0
+                for c in range(n_cats):
+                    if cat_codes[i, c] >= 0 and cat_codes[i, c] == cat_codes[j, c]:
+                        cat_matches += 1
+                cat_sim = np.float32(cat_matches) / np.float32(max(n_cats, 1))
+                
+                prop_sim = prop_table[prop_groups[i], prop_groups[j]]
+                score = weights[0] * dim_sim + weights[1] * cat_sim + weights[2] * prop_sim
+                
+                if score >= best_scores[i, TOP_K - 1]:
+                    insert_top_k(best_idx, best_scores, best_components, i, j, score, dim_sim, cat_sim, prop_sim)
+
+@njit(nogil=True, cache=True)
+def insert_top_k(top_idx, top_scores, top_components, r, j, score, dim_sim, cat_sim, prop_sim):
+    """
+    Insert match j into row r of a top-k table, ordered by score and then index (ties keep the
+    lower index in any visiting order). The row is indexed in place rather than sliced.
+    """
+    k = top_idx.shape[1]
+    if score > top_scores[r, k - 1] or (score == top_scores[r, k - 1] and j < top_idx[r, k - 1]):
+        pos = k - 1
+        while pos > 0 and (score > top_scores[r, pos - 1] or (score == top_scores[r, pos - 1] and j < top_idx[r, pos - 1])):
+            top_scores[r, pos] = top_scores[r, pos - 1]
+            top_idx[r, pos] = top_idx[r, pos - 1]
+            for c in range(3):
+                top_components[r, pos, c] = top_components[r, pos - 1, c]
+            pos -= 1
+        top_scores[r, pos] = score
+        top_idx[r, pos] = j
+        top_components[r, pos, 0] = dim_sim
+        top_components[r, pos, 1] = cat_sim
+        top_components[r, pos, 2] = prop_sim
+
+@njit(cache=True)
+def merge_top_k(best_idx, best_scores, best_components, row_start, top_idx, top_scores, top_components):
+    """Merge a tile's top-k table (row r belongs to RFQ row_start + r) into the running best_* arrays."""
+    for r in range(top_idx.shape[0]):
+        for slot in range(top_idx.shape[1]):
+            if top_idx[r, slot] < 0:
+                break
+            insert_top_k(best_idx, best_scores, best_components, row_start + r, top_idx[r, slot], top_scores[r, slot],
+                         top_components[r, slot, 0], top_components[r, slot, 1], top_components[r, slot, 2])
 
 if __name__ == "__main__":
     from data_loader import load_rfq_data
@@ -185,6 +426,40 @@ if __name__ == "__main__":
     
     logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
     
+    # Reference per-pair helpers (slow path), used only to spot-check the kernel below.
+    # They take two row positions into arrays preloaded once from the feature frame.
+    def calculate_dimension_similarity(i, j, dim_arr, interval_overlap_ratio):
+        """Calculate dimensional similarity using interval overlap (dim_arr holds min, max columns per feature)."""
+        similarities = []
+        
+        for min_pos in range(0, dim_arr.shape[1], 2):
+            overlap = interval_overlap_ratio(
+                dim_arr[i, min_pos], dim_arr[i, min_pos + 1],
+                dim_arr[j, min_pos], dim_arr[j, min_pos + 1]
+            )
+            similarities.append(overlap)
+        
+        return np.mean(similarities) if similarities else 0.0
+    
+    def calculate_categorical_similarity(i, j, cat_arr, categorical_match):
+        """Calculate categorical similarity using exact matches."""
+        matches = [categorical_match(cat_arr[i, pos], cat_arr[j, pos]) for pos in range(cat_arr.shape[1])]
+        return np.mean(matches) if matches else 0.0
+    
+    def calculate_grade_property_similarity(i, j, prop_arr, prop_ranges):
+        """Calculate grade property similarity using normalized differences."""
+        similarities = []
+        
+        for pos in range(prop_arr.shape[1]):
+            val1, val2 = prop_arr[i, pos], prop_arr[j, pos]
+            
+            # Normalize by feature range (computed once over the full dataset)
+            if not np.isnan(val1) and not np.isnan(val2) and prop_ranges[pos] > 0:
+                normalized_diff = abs(val1 - val2) / prop_ranges[pos]
+                similarities.append(max(0, 1 - normalized_diff))
+        
+        return np.mean(similarities) if similarities else 0.0
+    
     # Test similarity calculation
     print("Starting similarity calculation test...")
     
@@ -197,4 +472,29 @@ if __name__ == "__main__":
     similarity_results = calculate_rfq_similarity(feature_df)
     
     print(f"\nSimilarity calculation completed!")
-    print(f"Total similarity pairs: {len(similarity_results)}")
\ No newline at end of file
+    print(f"Total similarity pairs: {len(similarity_results)}")
+    
+    # Spot-check a sample of pairs against the reference helpers
+    dimension_features = [(min_col, max_col) for min_col, max_col in DIMENSION_FEATURES
+                          if min_col in feature_df.columns and max_col in feature_df.columns]
+    categorical_features = [col[:-len('_code')] for col in feature_df.columns if col.endswith('_clean_code')]
+    grade_property_features = [col for col in feature_df.columns if '_mid' in col and feature_df[col].notna().sum() > 0]
+    valid_df = feature_df[feature_df['id'].notna()].reset_index(drop=True)
+    dim_arr = valid_df[[col for pair in dimension_features for col in pair]].to_numpy(dtype=np.float32)
+    cat_arr = valid_df[categorical_features].to_numpy(dtype=object)
+    prop_arr = valid_df[grade_property_features].to_numpy(dtype=np.float32)
+    prop_ranges = (feature_df[grade_property_features].max() - feature_df[grade_property_features].min()).to_numpy()
+    positions = pd.Index(valid_df['id'])
+    
+    sample = similarity_results.sample(min(50, len(similarity_results)), random_state=0)
+    mismatches = 0
+    for i, j, *actual in zip(positions.get_indexer(sample['rfq_id']), positions.get_indexer(sample['match_id']),
+                             sample['dimension_similarity'], sample['categorical_similarity'], sample['property_similarity']):
+        expected = (
+            calculate_dimension_similarity(i, j, dim_arr, feature_df.attrs['interval_overlap_ratio']),
+            calculate_categorical_similarity(i, j, cat_arr, feature_df.attrs['categorical_match']),
+            calculate_grade_property_similarity(i, j, prop_arr, prop_ranges)
+        )
+        mismatches += not np.allclose(actual, expected, atol=1e-5)
+    
+    print(f"Reference check: {len(sample) - mismatches}/{len(sample)} sampled pairs match the per-pair helpers")